@@ -26,11 +26,19 @@ Quotas Firebase:
 import os
 import sys
 import json
+import hashlib
 import re
 import time
 import signal
+import socket
+import threading
+import traceback
 import unicodedata
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Tuple, Dict, Set, List
 from html.parser import HTMLParser
@@ -38,6 +46,7 @@ from html.parser import HTMLParser
 import a2s
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core import exceptions as google_exceptions
 
 # ============================================
 # Timezone France (avec gestion DST)
@@ -68,11 +77,22 @@ MAX_SESSION_HISTORY = 50     # Garder les 50 dernières sessions par joueur
 MIN_RECORD_THRESHOLD = 5     # Jamais de record < 5 joueurs
 MAX_SESSION_DURATION = 86400 # 24h max par session (protection anti-bug)
 LOCK_TIMEOUT = 35 * 60       # 35 minutes - si un lock est plus vieux, il est considéré abandonné
+RUN_DEADLINE = 31 * 60       # Arrêt propre avant le timeout du step GitHub (32 min)
+A2S_TIMEOUT = 2.0            # Timeout d'une requête A2S (UDP)
+A2S_ATTEMPTS = 3             # Essais par requête A2S: un paquet perdu ne coûte plus un tick
 STEAM_DELAY = 0.5            # Délai entre les appels Steam (anti rate-limit)
+STEAM_API_KEY = os.environ.get('STEAM_API_KEY', '')  # Optionnel: avatars via la Web API (sinon scraping du profil)
+BATCH_MAX_OPS = 450          # Firestore limite un batch à 500 opérations
+BATCH_MAX_ATTEMPTS = 3       # Envois d'une écriture à l'issue inconnue (timeout, réseau) avant abandon
+AVATAR_REFRESH_DAYS = int(os.environ.get('AVATAR_REFRESH_DAYS', '7'))  # Avatar revérifié sur Steam au plus tous les N jours
+AVATAR_CACHE_TTL = 3600      # Avatar Steam mémorisé 1h dans le run (évite de refetch les échecs)
 
 # État global
 running = True
+_stop_signal = None     # Signal reçu (affiché par la boucle, pas par le handler)
 _db = None
+_server_address = None  # (ip, port) résolu une fois au démarrage (resolve_server_address)
+_refs = {}  # Références Firestore fréquentes, créées une seule fois (init_refs)
 
 # ============================================
 # Cache mémoire
@@ -80,6 +100,7 @@ _db = None
 cache = {
     # Stats
     'hourly_stats': {},
+    'hourly_persisted': {},  # heure -> dernière valeur confirmée dans Firestore
     'daily_peak': 0,
     'record_peak': 0,
     'record_valid': False,
@@ -87,13 +108,17 @@ cache = {
     
     # Players
     'players': {},           # doc_id -> player data
-    'players_by_name': {},   # name.lower() -> doc_id
+    'players_by_name': {},   # name_key(name) -> doc_id (AMBIGUOUS_NAME si partagée par plusieurs joueurs)
+    'players_by_exact_name': {},  # exact_name_key(nom) -> doc_id, seulement pour les clés ambiguës
+    'dirty_players': set(),  # doc_ids modifiés depuis la dernière écriture de cache/players
+    'players_cache_ids': set(),  # doc_ids présents dans cache/players
     
     # État serveur (du run précédent, lu depuis Firestore)
     'prev_players': {},      # name -> {time, session_started_at, doc_id}
     'prev_count': 0,
     'is_offline': False,
     'last_update_time': None,  # Timestamp de la dernière MAJ de live/status
+    'live_fingerprint': None,  # Empreinte du dernier live/status écrit par la boucle
     
     # Sessions en cours (ce run)
     'sessions': {},          # name -> {started_at, doc_id}
@@ -111,14 +136,16 @@ cache = {
 # Signal handlers
 # ============================================
 def signal_handler(signum, frame):
-    global running
-    print(f"\n⚠️ Signal {signum} reçu, arrêt propre...")
+    # Aucun print ici: stdout bufferisé n'est pas réentrant (RuntimeError si le signal coupe une écriture).
+    # La boucle s'arrête en moins d'une seconde, affiche le signal et vide stdout en sortant.
+    global running, _stop_signal
     running = False
+    _stop_signal = signum
     
-    # Libérer le lock si possible
+    # Libérer le lock si possible (sans log, release_lock() affiche)
     try:
         if _db:
-            release_lock(_db)
+            _refs['lock'].delete()
     except:
         pass
 
@@ -130,17 +157,17 @@ signal.signal(signal.SIGINT, signal_handler)
 # ============================================
 def wait_for_next_interval():
     """Attend le prochain intervalle de 30 secondes (:00 ou :30)"""
-    now = datetime.now()
-    current_second = now.second
-    
-    if current_second < 30:
-        wait_until = 30
-    else:
-        wait_until = 60
-    
-    sleep_time = wait_until - current_second - now.microsecond / 1000000
-    if sleep_time > 0:
-        time.sleep(sleep_time)
+    # stdout bufferisé : les logs de l'itération partent en une écriture
+    sys.stdout.flush()
+    # Les fuseaux ont des décalages en minutes entières: l'epoch suffit pour viser :00/:30
+    sleep_time = QUERY_INTERVAL - time.time() % QUERY_INTERVAL
+    # Par tranches d'1s: un signal d'arrêt est pris en compte avant le SIGKILL du runner
+    deadline = time.monotonic() + sleep_time
+    while running:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(1.0, remaining))
 
 def format_duration(seconds):
     """Formate une durée en heures/minutes"""
@@ -172,19 +199,26 @@ def validate_player_time(time_val):
         return False
     return True
 
+# Octets ASCII non alphanumériques, supprimés par bytes.translate (un seul passage en C)
+NON_ALNUM_BYTES = bytes(c for c in range(128) if not chr(c).isalnum())
+
+@lru_cache(maxsize=4096)
 def normalize_name(name):
     """Normalise un nom pour la recherche"""
     if not name:
         return ""
-    normalized = unicodedata.normalize('NFKD', name)
-    ascii_name = normalized.encode('ASCII', 'ignore').decode('ASCII')
-    return re.sub(r'[^a-zA-Z0-9]', '', ascii_name).lower()
+    # Un nom ASCII est déjà sous forme NFKD: pas de décomposition Unicode
+    normalized = name if name.isascii() else unicodedata.normalize('NFKD', name)
+    ascii_name = normalized.encode('ASCII', 'ignore').translate(None, NON_ALNUM_BYTES)
+    return ascii_name.lower().decode('ASCII')
+
+DOC_ID_FORBIDDEN_RE = re.compile(r'[/\\.\[\]*`~]')
 
 def sanitize_doc_id(doc_id):
     """Nettoie un ID pour Firestore"""
     if not doc_id:
         return None
-    sanitized = re.sub(r'[/\\.\[\]*`~]', '_', str(doc_id))
+    sanitized = DOC_ID_FORBIDDEN_RE.sub('_', str(doc_id))
     sanitized = sanitized.strip('_')
     if not sanitized or len(sanitized) > 1500:
         return None
@@ -194,8 +228,41 @@ def sanitize_doc_id(doc_id):
 # Steam API
 # ============================================
 STEAMID64_BASE = 76561197960265728
-STEAM2_RE = re.compile(r"^STEAM_[0-5]:([0-1]):(\d+)$", re.IGNORECASE)
+STEAM_API_SUMMARIES_URL = "https://api.steampowered.com/ISteamUser/GetPlayerSummaries/v2/"
+STEAM_API_MAX_IDS = 100  # GetPlayerSummaries accepte 100 SteamID64 par requête
+
+# Session HTTP partagée: connexions keep-alive vers Steam réutilisées (pas de TLS à chaque appel)
+# Erreurs réseau et 5xx transitoires retentées sur la même connexion; 429 non retenté (skip géré à l'appel)
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504), raise_on_status=False),
+))
+_http.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+})
+_avatar_cache = {}  # steamid64 -> (time.monotonic(), url ou None)
+# Requêtes Steam indépendantes (profils de plusieurs arrivées) lancées en parallèle
+_steam_pool = ThreadPoolExecutor(max_workers=4)
+# Espacement partagé par les threads du pool: le parallélisme ne contourne pas STEAM_DELAY
+_steam_lock = threading.Lock()
+_steam_last_call = 0.0
 
+def steam_throttle():
+    """Attend que STEAM_DELAY se soit écoulé depuis la dernière requête steamcommunity.com (tous threads)"""
+    global _steam_last_call
+    with _steam_lock:
+        wait = _steam_last_call + STEAM_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _steam_last_call = time.monotonic()
+
+# SteamID strictement ASCII: pas de classes Unicode ni de IGNORECASE (entrée mise en majuscules)
+STEAM2_RE = re.compile(r"^STEAM_[0-5]:([01]):([0-9]+)$", re.ASCII)
+
+@lru_cache(maxsize=4096)
 def steam2_to_steamid64(steamid):
     """Convertit STEAM_0:0:123456789 en SteamID64"""
     if not steamid:
@@ -203,6 +270,10 @@ def steam2_to_steamid64(steamid):
     steamid = steamid.strip()
     if steamid.isdigit() and len(steamid) >= 16:
         return steamid
+    steamid = steamid.upper()
+    # IDs auto_xxx (joueurs sans Steam) et autres formats: rejetés sans passer par la regex
+    if not steamid.startswith('STEAM_'):
+        return None
     m = STEAM2_RE.match(steamid)
     if not m:
         return None
@@ -211,10 +282,14 @@ def steam2_to_steamid64(steamid):
     accountid = 2 * z + x
     return str(STEAMID64_BASE + accountid)
 
+class SearchResultsFull(Exception):
+    """Levée quand assez de résultats de recherche sont lus: le reste du HTML est ignoré"""
+
 class SteamSearchParser(HTMLParser):
-    """Extrait tous les <a class="searchPersonaName" href="...">NOM</a> de la recherche Steam"""
-    def __init__(self):
+    """Extrait les <a class="searchPersonaName" href="...">NOM</a> de la recherche Steam (limit premiers)"""
+    def __init__(self, limit=None):
         super().__init__()
+        self.limit = limit
         self.results = []  # Liste de (nom, url)
         self._in_target_a = False
         self._current_href = None
@@ -244,6 +319,15 @@ class SteamSearchParser(HTMLParser):
             self._in_target_a = False
             self._current_href = None
             self._current_text_parts = []
+            if self.limit and len(self.results) >= self.limit:
+                raise SearchResultsFull()
+
+ANIMATED_AVATAR_EXTS = (".gif", ".webm", ".mp4")
+STATIC_AVATAR_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+AVATAR_BLOCK_MARKER = "playerAvatarAutoSizeInner"
+
+class AvatarBlockEnd(Exception):
+    """Levée quand le bloc avatar est fermé: le reste de la page est inutile"""
 
 class SteamAvatarParser(HTMLParser):
     """Parse la page profil Steam pour extraire l'avatar"""
@@ -263,17 +347,24 @@ class SteamAvatarParser(HTMLParser):
         return first.split(" ")[0].strip()
 
     def handle_starttag(self, tag, attrs):
-        a = dict(attrs)
-        klass = a.get("class", "")
-
+        # Seuls div/img/source comptent : pas de dict(attrs) pour les autres balises
         if tag == "div":
+            klass = ""
+            for key, value in attrs:
+                if key == "class":
+                    klass = value or ""
+                    break
             if "playerAvatarAutoSizeInner" in klass:
                 self.in_inner += 1
             elif self.in_inner > 0 and "profile_avatar_frame" in klass:
                 self.in_frame += 1
+            return
 
+        if tag != "img" and tag != "source":
+            return
         if self.in_inner <= 0 or self.in_frame > 0:
             return
+        a = dict(attrs)
 
         if tag == "img":
             url = None
@@ -284,15 +375,15 @@ class SteamAvatarParser(HTMLParser):
 
             if url:
                 lower_url = url.lower()
-                if self.animated is None and any(lower_url.endswith(ext) for ext in (".gif", ".webm", ".mp4")):
+                if self.animated is None and lower_url.endswith(ANIMATED_AVATAR_EXTS):
                     self.animated = url
-                elif any(lower_url.endswith(ext) for ext in (".jpg", ".jpeg", ".png", ".webp")):
+                elif lower_url.endswith(STATIC_AVATAR_EXTS):
                     self.static_candidates.append(url)
 
         if tag == "source":
             media = (a.get("media") or "").strip()
             url = self._first_url_from_srcset(a.get("srcset", "") or "")
-            if url and any(url.lower().endswith(ext) for ext in (".jpg", ".jpeg", ".png", ".webp")):
+            if url and url.lower().endswith(STATIC_AVATAR_EXTS):
                 if "prefers-reduced-motion" in media:
                     self.static_candidates.insert(0, url)
                 else:
@@ -306,6 +397,32 @@ class SteamAvatarParser(HTMLParser):
             return
         if self.in_inner > 0:
             self.in_inner -= 1
+            if self.in_inner == 0:
+                raise AvatarBlockEnd()
+
+def parse_steam_avatar(html):
+    """Extrait l'URL de l'avatar (animé en priorité) d'une page profil Steam"""
+    # Sauter directement au bloc avatar (str.find en C) au lieu de parser toute la page
+    start = html.find(AVATAR_BLOCK_MARKER)
+    if start == -1:
+        return None
+    start = html.rfind('<', 0, start)
+    
+    parser = SteamAvatarParser()
+    try:
+        parser.feed(html[max(start, 0):])
+    except AvatarBlockEnd:
+        pass
+    
+    # Priorité à l'avatar animé, sinon statique
+    if parser.animated:
+        return parser.animated
+    if parser.static_candidates:
+        return parser.static_candidates[0]
+    return None
+
+PROFILES_URL_RE = re.compile(r'/profiles/([0-9]{17})(?:/|$)', re.ASCII)
+STEAMID_JSON_RE = re.compile(r'"steamid"\s*:\s*"(\d+)"')
 
 class SteamProfileParser(HTMLParser):
     """Parse le profil Steam pour extraire SteamID (pour la recherche par nom)"""
@@ -324,21 +441,67 @@ class SteamProfileParser(HTMLParser):
     
     def handle_data(self, data):
         if self.in_script and 'g_rgProfileData' in data:
-            match = re.search(r'"steamid"\s*:\s*"(\d+)"', data)
+            match = STEAMID_JSON_RE.search(data)
             if match:
                 self.steam_id = match.group(1)
 
+@lru_cache(maxsize=4096)
 def steam64_to_steam2(steam64):
     """Convertit SteamID64 en STEAM_0:X:Y"""
     try:
-        steam64_int = int(steam64)
-        y = steam64_int - STEAMID64_BASE
-        x = y % 2
-        y = (y - x) // 2
-        return f"STEAM_0:{x}:{y}"
+        account_id = int(steam64) - STEAMID64_BASE
+        return f"STEAM_0:{account_id & 1}:{account_id >> 1}"
     except:
         return None
 
+def avatar_is_fresh(data, now):
+    """True si l'avatar du joueur a été vérifié il y a moins de AVATAR_REFRESH_DAYS"""
+    checked_at = data.get('avatar_checked_at')
+    if not data.get('avatar_url') or not checked_at:
+        return False
+    try:
+        return now - datetime.fromisoformat(checked_at) < timedelta(days=AVATAR_REFRESH_DAYS)
+    except (TypeError, ValueError):
+        return False
+
+def fetch_steam_avatars(steam_ids):
+    """
+    Récupère les avatars de plusieurs joueurs en une requête Web API (GetPlayerSummaries).
+    Retourne {steam_id: avatar_url}, vide sans STEAM_API_KEY ou en cas d'erreur.
+    NOTE: l'API ne donne que l'avatar statique (pas les avatars animés du profil).
+    """
+    if not STEAM_API_KEY:
+        return {}
+    
+    by_steamid64 = {}
+    for steam_id in steam_ids:
+        steamid64 = steam2_to_steamid64(steam_id)
+        if steamid64:
+            by_steamid64[steamid64] = steam_id
+    
+    avatars = {}
+    ids = list(by_steamid64)
+    for i in range(0, len(ids), STEAM_API_MAX_IDS):
+        try:
+            r = _http.get(
+                STEAM_API_SUMMARIES_URL,
+                params={'key': STEAM_API_KEY, 'steamids': ','.join(ids[i:i + STEAM_API_MAX_IDS])},
+                timeout=10,
+            )
+            if r.status_code == 429:
+                print("          ⏳ Rate-limit Steam API, skip...")
+                break
+            r.raise_for_status()
+            for summary in r.json().get('response', {}).get('players', []):
+                steam_id = by_steamid64.get(summary.get('steamid'))
+                if steam_id and summary.get('avatarfull'):
+                    avatars[steam_id] = summary['avatarfull']
+        except Exception as e:
+            # Pas le message: l'URL contient la clé API
+            print(f"          ⚠️ Steam API: {type(e).__name__}")
+            break
+    return avatars
+
 def fetch_steam_avatar(steam_id):
     """Récupère l'URL de l'avatar Steam à partir d'un Steam ID"""
     try:
@@ -346,36 +509,32 @@ def fetch_steam_avatar(steam_id):
         if not steamid64:
             return None
         
-        # Anti rate-limit
-        time.sleep(STEAM_DELAY)
+        cached = _avatar_cache.get(steamid64)
+        if cached and time.monotonic() - cached[0] < AVATAR_CACHE_TTL:
+            return cached[1]
+        
+        # Anti rate-limit (espacement commun aux requêtes parallèles)
+        steam_throttle()
         
         url = f"https://steamcommunity.com/profiles/{steamid64}/?l=english"
-        r = requests.get(
+        # Page lue en entier: la connexion keep-alive retourne au pool de _http (pas de nouveau handshake TLS);
+        # seul le bloc avatar est parsé
+        r = _http.get(
             url,
             timeout=15,
             headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9",
                 "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             },
         )
-        
         if r.status_code == 429:
-            print(f"          ⏳ Rate-limit Steam, skip...")
+            print("          ⏳ Rate-limit Steam, skip...")
             return None
         
         r.raise_for_status()
-        
-        parser = SteamAvatarParser()
-        parser.feed(r.text)
-        
-        # Priorité à l'avatar animé, sinon statique
-        if parser.animated:
-            return parser.animated
-        if parser.static_candidates:
-            return parser.static_candidates[0]
-        
-        return None
+        avatar = parse_steam_avatar(r.text)
+        # Rate-limit et erreurs réseau ne sont pas mémorisés: nouvel essai à la prochaine query
+        _avatar_cache[steamid64] = (time.monotonic(), avatar)
+        return avatar
     except Exception as e:
         return None
 
@@ -393,16 +552,13 @@ def fetch_steam_info(name, max_results_to_check=8):
         if not name:
             return None, None
         
-        # Anti rate-limit
-        time.sleep(STEAM_DELAY)
+        # Anti rate-limit (espacement commun aux recherches parallèles)
+        steam_throttle()
         
         # Chercher le profil
-        resp = requests.get(
-            f"https://steamcommunity.com/search/SearchCommunityAjax",
+        resp = _http.get(
+            "https://steamcommunity.com/search/SearchCommunityAjax",
             params={'text': name, 'filter': 'users', 'sessionid': '', 'page': 1},
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            },
             timeout=10
         )
         
@@ -414,40 +570,44 @@ def fetch_steam_info(name, max_results_to_check=8):
         
         # Parser HTML pour extraire tous les résultats
         # Format: <a class="searchPersonaName" href="URL">NOM</a>
-        parser = SteamSearchParser()
-        parser.feed(html)
+        # Seuls les N premiers résultats sont examinés: le parsing s'arrête dès qu'ils sont lus
+        parser = SteamSearchParser(limit=max_results_to_check)
+        try:
+            parser.feed(html)
+        except SearchResultsFull:
+            pass
         results = parser.results  # Liste de (nom, url)
         
         if not results:
             return None, None
         
-        # Chercher une correspondance exacte dans les N premiers résultats
-        exact_matches = []
-        for i, (result_name, result_url) in enumerate(results[:max_results_to_check]):
-            if result_name == name:  # Correspondance exacte (case-sensitive)
-                exact_matches.append((result_name, result_url))
+        # Chercher une correspondance exacte (case-sensitive) dans les N premiers résultats, en une passe
+        profile_url = None
+        for result_name, result_url in results[:max_results_to_check]:
+            if result_name != name:
+                continue
+            # Plusieurs correspondances exactes = ambiguïté, on ne peut pas choisir
+            if profile_url is not None:
+                print(f"        ⚠️ Multiples profils Steam trouvés pour '{name}'")
+                return None, None
+            profile_url = result_url
         
         # Aucune correspondance exacte
-        if not exact_matches:
-            return None, None
-        
-        # Plusieurs correspondances exactes = ambiguïté, on ne peut pas choisir
-        if len(exact_matches) > 1:
-            print(f"        ⚠️ Multiples profils Steam trouvés pour '{name}'")
+        if profile_url is None:
             return None, None
         
-        profile_url = exact_matches[0][1]
+        # URL /profiles/<SteamID64>: l'ID est dans l'URL, seul l'avatar demande la page (lue en streaming)
+        m = PROFILES_URL_RE.search(profile_url)
+        if m:
+            steam2 = steam64_to_steam2(m.group(1))
+            return steam2, (fetch_steam_avatar(steam2) if steam2 else None)
         
-        # Anti rate-limit
-        time.sleep(STEAM_DELAY)
+        # Anti rate-limit (espacement commun aux recherches parallèles)
+        steam_throttle()
         
         # Récupérer le profil
-        resp = requests.get(
+        resp = _http.get(
             profile_url + "?l=english",
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9",
-            },
             timeout=15
         )
         if resp.status_code != 200:
@@ -459,9 +619,7 @@ def fetch_steam_info(name, max_results_to_check=8):
         steam2 = steam64_to_steam2(profile_parser.steam_id) if profile_parser.steam_id else None
         
         # Extraire l'avatar
-        avatar_parser = SteamAvatarParser()
-        avatar_parser.feed(resp.text)
-        avatar = avatar_parser.animated or (avatar_parser.static_candidates[0] if avatar_parser.static_candidates else None)
+        avatar = parse_steam_avatar(resp.text)
         
         return steam2, avatar
         
@@ -484,14 +642,27 @@ def init_firebase():
     cred = credentials.Certificate(json.loads(service_account_json))
     firebase_admin.initialize_app(cred)
     _db = firestore.client()
+    init_refs(_db)
     return _db
 
+def init_refs(db):
+    """Construit une fois les références utilisées à chaque query (même client, même canal gRPC)"""
+    _refs.update({
+        'lock': db.collection('system').document('lock'),
+        'reset': db.collection('system').document('reset'),
+        'live': db.collection('live').document('status'),
+        'records': db.collection('stats').document('records'),
+        'days': db.collection('stats').document('daily').collection('days'),
+        'players': db.collection('players'),
+        'players_cache': db.collection('cache').document('players'),
+    })
+
 def acquire_lock(db):
     """
     Acquiert un lock pour éviter les runs parallèles.
     Retourne True si le lock est acquis, False sinon.
     """
-    lock_ref = db.collection('system').document('lock')
+    lock_ref = _refs['lock']
     now = get_france_time()
     
     try:
@@ -534,28 +705,181 @@ def acquire_lock(db):
 def release_lock(db):
     """Libère le lock"""
     try:
-        db.collection('system').document('lock').delete()
+        _refs['lock'].delete()
         print("    🔓 Lock libéré")
     except Exception as e:
         print(f"    ⚠️ Erreur release lock: {e}")
 
+@firestore.transactional
+def bump_record(transaction, new_count, peak_date):
+    """
+    Met à jour stats/records si new_count dépasse le record (lecture + écriture atomiques).
+    Retourne (record en vigueur, nouveau record?) ou (None, False) si le document n'existe pas.
+    """
+    snapshot = _refs['records'].get(transaction=transaction)
+    if not snapshot.exists:
+        return None, False
+    current_record = snapshot.to_dict().get('peak_count', 0)
+    if new_count <= current_record:
+        return current_record, False
+    transaction.set(_refs['records'], {
+        'peak_count': new_count,
+        'peak_date': peak_date
+    })
+    return new_count, True
+
+# ============================================
+# Batch d'écritures
+# ============================================
+# Erreurs qui prouvent qu'un commit n'a rien écrit (requête refusée, ou données rejetées avant envoi)
+BATCH_REJECTED_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.NotFound,
+    google_exceptions.AlreadyExists,
+    google_exceptions.FailedPrecondition,
+    google_exceptions.PermissionDenied,
+    google_exceptions.OutOfRange,
+    ValueError,
+    TypeError,
+)
+
+class FirestoreBatch:
+    """
+    Regroupe plusieurs écritures Firestore en un seul commit (1 RPC au lieu de N).
+    Flush automatique avant d'atteindre la limite de 500 opérations par batch.
+    
+    on_commit est appelé une fois l'écriture confirmée: le cache suit Firestore, jamais l'inverse.
+    Un commit refusé (BATCH_REJECTED_ERRORS: rien n'a été écrit) est rejoué écriture par écriture,
+    pour qu'un document en erreur (ex: joueur supprimé par le frontend) ne fasse pas perdre les autres.
+    Après une erreur à l'issue inconnue (timeout, réseau), le batch a pu être appliqué: les écritures
+    (valeurs absolues, donc idempotentes) restent en attente et repartent au commit suivant.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._ops = []     # (ref, data, merge ou None pour update, on_commit, envois déjà tentés)
+        self._paths = set()  # Documents ayant une écriture en attente
+        self._flushed = 0  # Écritures déjà envoyées par un flush automatique
+
+    def set(self, ref, data, merge=False, on_commit=None):
+        self._add(ref, data, merge, on_commit)
+
+    def update(self, ref, data, on_commit=None):
+        self._add(ref, data, None, on_commit)
+
+    def _add(self, ref, data, merge, on_commit):
+        self._ops.append((ref, data, merge, on_commit, 0))
+        self._paths.add(ref.path)
+        if len(self._ops) >= BATCH_MAX_OPS:
+            self._flushed += self._send()
+
+    def wait_for(self, ref):
+        """Envoie les écritures en attente si ref en fait partie (la suivante dépend de leur résultat)"""
+        if ref.path in self._paths:
+            self._flushed += self._send()
+
+    def commit(self):
+        """Envoie les opérations en attente, retourne le nombre d'écritures confirmées depuis le dernier commit"""
+        count = self._flushed + self._send()
+        self._flushed = 0
+        return count
+
+    def _send(self):
+        ops = self._ops
+        if not ops:
+            return 0
+        self._ops = []
+        self._paths = set()
+        
+        retry = []
+        try:
+            batch = self.db.batch()
+            for ref, data, merge, _, _ in ops:
+                if merge is None:
+                    batch.update(ref, data)
+                else:
+                    batch.set(ref, data, merge=merge)
+            batch.commit()
+            done = ops
+        except BATCH_REJECTED_ERRORS as e:
+            print(f"       ⚠️ Batch refusé ({e}), {len(ops)} écriture(s) rejouée(s) une par une")
+            done = []
+            for op in ops:
+                ref, data, merge, _, _ = op
+                try:
+                    if merge is None:
+                        ref.update(data)
+                    else:
+                        ref.set(data, merge=merge)
+                    done.append(op)
+                except BATCH_REJECTED_ERRORS as e:
+                    print(f"       ❌ {ref.path}: {e}")
+                except Exception as e:
+                    print(f"       ⚠️ {ref.path}: {e}")
+                    retry.append(op)
+        except Exception as e:
+            print(f"       ⚠️ Batch: {e}")
+            done = []
+            retry = ops
+        
+        if retry:
+            self._keep_pending(retry)
+        
+        for _, _, _, on_commit, _ in done:
+            if on_commit:
+                try:
+                    on_commit()
+                except Exception as e:
+                    print(f"       ⚠️ Cache après commit: {e}")
+        return len(done)
+
+    def _keep_pending(self, ops):
+        """Garde pour le commit suivant les écritures à l'issue inconnue (BATCH_MAX_ATTEMPTS envois au plus)"""
+        kept = [op[:4] + (op[4] + 1,) for op in ops if op[4] + 1 < BATCH_MAX_ATTEMPTS]
+        if len(kept) < len(ops):
+            print(f"       ❌ {len(ops) - len(kept)} écriture(s) abandonnée(s) après {BATCH_MAX_ATTEMPTS} envois")
+        if kept:
+            print(f"       🔁 {len(kept)} écriture(s) renvoyée(s) au prochain commit")
+        self._ops = kept + self._ops
+        self._paths.update(op[0].path for op in kept)
+
 # ============================================
 # Player lookup
 # ============================================
+# Marqueur d'une clé de nom partagée par plusieurs joueurs ("Alex" / "alex_")
+AMBIGUOUS_NAME = object()
+
+def name_key(name):
+    """
+    Clé unique d'index d'un nom: sa forme normalisée, ou strip + casefold
+    si le nom n'a aucun caractère ASCII alphanumérique (sinon tous en "").
+    """
+    return normalize_name(name) or name.strip().casefold()
+
 def find_player(name):
     """Trouve un joueur par nom Steam dans le cache"""
     if not name:
         return None
-    key = name.lower().strip()
-    normalized = normalize_name(name)
-    
     # Recherche par nom Steam uniquement
-    doc_id = cache['players_by_name'].get(key) or cache['players_by_name'].get(normalized)
+    doc_id = cache['players_by_name'].get(name_key(name))
+    if doc_id is AMBIGUOUS_NAME:
+        # Clé partagée: seul le nom exact départage, sinon aucune session n'est attribuée
+        doc_id = cache['players_by_exact_name'].get(exact_name_key(name))
+        if doc_id is AMBIGUOUS_NAME:
+            return None
     if doc_id and doc_id in cache['players']:
         return (doc_id, cache['players'][doc_id])
     
     return None
 
+def auto_doc_id(name):
+    """ID déterministe d'un joueur sans SteamID: auto_<nom normalisé>, ou auto_<digest> si le nom normalisé est vide"""
+    key = normalize_name(name)
+    if key:
+        return sanitize_doc_id(f"auto_{key}")
+    # Nom sans caractère ASCII alphanumérique: un digest du nom évite que tous partagent le même document
+    # (hash() est salé par processus: blake2b garde le même ID d'un run à l'autre)
+    return f"auto_{hashlib.blake2b(name.encode('utf-8'), digest_size=4).hexdigest()}"
+
 def update_player_cache(doc_id, data):
     """Met à jour le cache local d'un joueur"""
     if not doc_id:
@@ -564,11 +888,80 @@ def update_player_cache(doc_id, data):
         cache['players'][doc_id].update(data)
     else:
         cache['players'][doc_id] = data
+    cache['dirty_players'].add(doc_id)
+    index_player_name(data.get('name', ''), doc_id)
+
+def player_written(doc_id, data, name=None, session=None, event=None, message=None):
+    """
+    Appliqué une fois l'écriture d'un joueur confirmée (on_commit de FirestoreBatch):
+    cache, session en cours et feed ne changent qu'après Firestore.
+    event = (type, durée, timestamp) de l'événement du feed.
+    """
+    update_player_cache(doc_id, data)
+    if session:
+        cache['sessions'][name] = session
+    if event:
+        event_type, duration, timestamp = event
+        add_activity_event(event_type, name, duration, doc_id, timestamp=timestamp)
+    if message:
+        print(message)
+
+def index_player_name(name, doc_id):
+    """Indexe un nom Steam pour find_player (une clé partagée par deux joueurs est marquée ambiguë)"""
+    if not name:
+        return
+    by_name = cache['players_by_name']
+    key = name_key(name)
+    current = by_name.setdefault(key, doc_id)
+    if current == doc_id:
+        return
     
-    name = data.get('name', '')
-    if name:
-        cache['players_by_name'][name.lower().strip()] = doc_id
-        cache['players_by_name'][normalize_name(name)] = doc_id
+    # Deux joueurs sur la même clé: le dernier indexé ne doit pas capter les sessions de l'autre
+    if current is not AMBIGUOUS_NAME:
+        by_name[key] = AMBIGUOUS_NAME
+        other_name = cache['players'].get(current, {}).get('name')
+        if other_name:
+            index_exact_name(other_name, current)
+        print(f"    ⚠️ Noms ambigus: '{name}' et '{other_name}' ({doc_id} / {current})")
+    index_exact_name(name, doc_id)
+
+def exact_name_key(name):
+    """Nom exact à la casse près (comme l'ancienne recherche lower().strip())"""
+    return name.strip().casefold()
+
+def index_exact_name(name, doc_id):
+    """Indexe le nom exact d'un joueur dont la clé est ambiguë"""
+    exact = cache['players_by_exact_name']
+    key = exact_name_key(name)
+    current = exact.setdefault(key, doc_id)
+    if current != doc_id:
+        exact[key] = AMBIGUOUS_NAME
+
+def name_is_ambiguous(name):
+    """True si la clé du nom est partagée par plusieurs joueurs (find_player a pu ne rien attribuer)"""
+    return cache['players_by_name'].get(name_key(name)) is AMBIGUOUS_NAME
+
+def load_players(docs):
+    """Remplace le cache des joueurs par les documents donnés, retourne le nombre lu"""
+    # Tout le flux est lu avant de toucher au cache: un stream interrompu laisse l'ancien cache intact
+    players = {doc.id: doc.to_dict() for doc in docs}
+    cache['players'].clear()
+    cache['players'].update(players)
+    cache['players_by_name'].clear()
+    cache['players_by_exact_name'].clear()
+    for doc_id, data in players.items():
+        index_player_name(data.get('name', ''), doc_id)
+    return len(players)
+
+# Seuls champs des documents joueurs lus par le backend (le reste n'est jamais téléchargé)
+PLAYER_FIELDS = [
+    'name', 'steam_id', 'roles', 'ingame_names', 'avatar_url', 'avatar_checked_at',
+    'total_time_seconds', 'session_count', 'is_auto_detected', 'session_history',
+]
+
+def reload_players(db):
+    """Recharge tous les joueurs depuis Firestore (stream: documents décodés au fil de l'eau)"""
+    return load_players(_refs['players'].select(PLAYER_FIELDS).stream())
 
 # ============================================
 # Activity Feed
@@ -602,7 +995,7 @@ def check_and_handle_reset(db):
     Retourne True si un signal a été détecté et traité.
     """
     try:
-        doc = db.collection('system').document('reset').get()
+        doc = _refs['reset'].get()
         if not doc.exists:
             return False
         
@@ -612,35 +1005,25 @@ def check_and_handle_reset(db):
         
         if not reset_at_str:
             # Document existe mais pas de timestamp, le supprimer
-            db.collection('system').document('reset').delete()
+            _refs['reset'].delete()
             return False
         
         # Parser le timestamp
         try:
             reset_at = datetime.fromisoformat(reset_at_str.replace('Z', '+00:00'))
         except:
-            db.collection('system').document('reset').delete()
+            _refs['reset'].delete()
             return False
         
         # Comparer avec le démarrage du run
         if cache['run_started_at'] and reset_at > cache['run_started_at']:
             # Supprimer le flag avant traitement
-            db.collection('system').document('reset').delete()
+            _refs['reset'].delete()
             
             if reset_type == 'reload':
                 # Simple reload des données (après scanner, modification joueur, etc.)
                 print(f"       🔄 RELOAD détecté! Rechargement des données joueurs...")
-                cache['players'].clear()
-                cache['players_by_name'].clear()
-                docs = db.collection('players').get()
-                for doc in docs:
-                    player_data = doc.to_dict()
-                    doc_id = doc.id
-                    cache['players'][doc_id] = player_data
-                    name = player_data.get('name', '')
-                    if name:
-                        cache['players_by_name'][name.lower().strip()] = doc_id
-                        cache['players_by_name'][normalize_name(name)] = doc_id
+                reload_players(db)
                 print(f"       ✅ {len(cache['players'])} joueurs rechargés")
             else:
                 # Reset complet avec réinitialisation des sessions
@@ -653,7 +1036,7 @@ def check_and_handle_reset(db):
             return True
         else:
             # Reset ancien (avant ce run), juste supprimer le document
-            db.collection('system').document('reset').delete()
+            _refs['reset'].delete()
             return False
         
     except Exception as e:
@@ -663,26 +1046,15 @@ def check_and_handle_reset(db):
 def reload_players_from_firestore(db):
     """Recharge toutes les données des joueurs depuis Firestore après un reset"""
     try:
-        # Vider le cache des joueurs
-        cache['players'].clear()
-        cache['players_by_name'].clear()
-        
         # Recharger les joueurs
-        docs = db.collection('players').get()
-        for doc in docs:
-            data = doc.to_dict()
-            doc_id = doc.id
-            cache['players'][doc_id] = data
-            name = data.get('name', '')
-            if name:
-                cache['players_by_name'][name.lower().strip()] = doc_id
-                cache['players_by_name'][normalize_name(name)] = doc_id
+        reload_players(db)
         
         # Réinitialiser les sessions en cours pour qu'elles démarrent maintenant
         # NOTE: NE PAS incrémenter session_count ici!
         # La session était déjà comptée à l'arrivée initiale du joueur.
         # On reset juste le started_at pour que le temps post-reset soit comptabilisé.
         now = get_france_time()
+        now_iso = now.isoformat()
         sessions_updated = 0
         
         for name, session in cache['sessions'].items():
@@ -690,8 +1062,8 @@ def reload_players_from_firestore(db):
             doc_id = session.get('doc_id')
             if doc_id and doc_id in cache['players']:
                 try:
-                    db.collection('players').document(doc_id).update({
-                        'current_session_start': now.isoformat()
+                    _refs['players'].document(doc_id).update({
+                        'current_session_start': now_iso
                         # PAS de session_count - déjà incrémenté à l'arrivée
                     })
                     sessions_updated += 1
@@ -715,17 +1087,18 @@ def reload_players_from_firestore(db):
                 'name': name,
                 'time': 0,  # Temps reset à 0
                 'doc_id': doc_id,
-                'session_started_at': now.isoformat()
+                'session_started_at': now_iso
             })
         
         try:
-            db.collection('live').document('status').set({
+            cache['live_fingerprint'] = None
+            _refs['live'].set({
                 'ok': True,
                 'count': len(online_players),
                 'players': online_players,
                 'activity_feed': cache['activity_feed'],
-                'timestamp': now.isoformat(),
-                'updatedAt': now.isoformat()
+                'timestamp': now_iso,
+                'updatedAt': now_iso
             })
         except:
             pass
@@ -741,8 +1114,12 @@ def reload_players_from_firestore(db):
 # ============================================
 # Session Management
 # ============================================
-def finalize_session(db, name, doc_id, started_at, ended_at, writes):
-    """Finalise une session : calcule durée, met à jour total, ajoute à l'historique"""
+def finalize_session(db, name, doc_id, started_at, ended_at, writes, batch=None):
+    """
+    Finalise une session : calcule durée, met à jour total, ajoute à l'historique.
+    Avec un FirestoreBatch, l'écriture est ajoutée au batch (comptée à son commit)
+    et le cache du joueur n'est mis à jour qu'une fois le commit confirmé.
+    """
     if not doc_id or not started_at:
         return writes
     
@@ -757,6 +1134,11 @@ def finalize_session(db, name, doc_id, started_at, ended_at, writes):
         print(f"          ⚠️ Session > 24h pour {name}, capée à 24h")
         duration = MAX_SESSION_DURATION
     
+    ref = _refs['players'].document(doc_id)
+    if batch:
+        # Écriture déjà en attente sur ce joueur: l'envoyer pour partir de son historique à jour
+        batch.wait_for(ref)
+    
     # Récupérer les données du joueur
     data = cache['players'].get(doc_id, {})
     
@@ -811,19 +1193,23 @@ def finalize_session(db, name, doc_id, started_at, ended_at, writes):
         print(f"          ⏭️ {name}: session déjà enregistrée, ignorée")
         # Si on a nettoyé des doublons, sauvegarder quand même
         if len(cleaned_history) < len(existing_history):
-            try:
-                db.collection('players').document(doc_id).update({
-                    'session_history': cleaned_history,
-                    'session_count': len(cleaned_history)
-                })
-                update_player_cache(doc_id, {
-                    **data,
-                    'session_history': cleaned_history,
-                    'session_count': len(cleaned_history)
-                })
-                print(f"          🧹 Historique nettoyé: {len(existing_history)} → {len(cleaned_history)}")
-            except:
-                pass
+            cleanup = {
+                'session_history': cleaned_history,
+                'session_count': len(cleaned_history)
+            }
+            on_commit = partial(
+                player_written, doc_id, cleanup,
+                message=f"          🧹 Historique nettoyé: {len(existing_history)} → {len(cleaned_history)}"
+            )
+            if batch:
+                batch.update(ref, cleanup, on_commit=on_commit)
+            else:
+                try:
+                    ref.update(cleanup)
+                    writes += 1
+                    on_commit()
+                except:
+                    pass
         return writes
     
     # PROTECTION ANTI-CHEVAUCHEMENT
@@ -869,30 +1255,37 @@ def finalize_session(db, name, doc_id, started_at, ended_at, writes):
     # Mettre à jour Firestore
     # IMPORTANT: Synchroniser session_count avec session_history.length
     # pour garantir la cohérence (session_count = nombre de sessions terminées)
-    try:
-        db.collection('players').document(doc_id).update({
-            'total_time_seconds': new_total,
-            'last_seen': firestore.SERVER_TIMESTAMP,
-            'current_session_start': None,
-            'session_history': cleaned_history,
-            'session_count': len(cleaned_history)  # Toujours cohérent
-        })
-        writes += 1
-        
-        # Mettre à jour le cache
-        update_player_cache(doc_id, {
-            **data,
+    # Total absolu (comme session_history): une écriture rejouée après un commit incertain
+    # ne compte pas la session deux fois, et total et historique restent cohérents
+    update = {
+        'total_time_seconds': new_total,
+        'last_seen': firestore.SERVER_TIMESTAMP,
+        'current_session_start': None,
+        'session_history': cleaned_history,
+        'session_count': len(cleaned_history)  # Toujours cohérent
+    }
+    
+    # Cache et feed d'activité mis à jour une fois l'écriture confirmée
+    on_commit = partial(
+        player_written, doc_id, {
             'total_time_seconds': new_total,
             'session_history': cleaned_history,
             'session_count': len(cleaned_history)
-        })
-        
-        # Ajouter au feed d'activité
-        add_activity_event('leave', name, duration, doc_id, timestamp=ended_at)
-        
-        print(f"          👋 {name} (+{format_duration(duration)})")
-    except Exception as e:
-        print(f"          ❌ Erreur finalisation {name}: {e}")
+        },
+        name=name,
+        event=('leave', duration, ended_at),
+        message=f"          👋 {name} (+{format_duration(duration)})"
+    )
+    
+    if batch:
+        batch.update(ref, update, on_commit=on_commit)
+    else:
+        try:
+            ref.update(update)
+            writes += 1
+            on_commit()
+        except Exception as e:
+            print(f"          ❌ Erreur finalisation {name}: {e}")
     
     return writes
 
@@ -912,7 +1305,7 @@ def write_players_cache(db):
     # Lire les données existantes pour préserver les modifications du frontend
     existing_cache = {}
     try:
-        doc = db.collection('cache').document('players').get()
+        doc = _refs['players_cache'].get()
         if doc.exists:
             existing_cache = doc.to_dict().get('players', {})
     except:
@@ -929,18 +1322,6 @@ def write_players_cache(db):
     
     # Ensuite, mettre à jour avec les données du backend
     for doc_id, data in cache['players'].items():
-        # Garder 30 sessions dans le cache (couvre ~1 mois d'activité)
-        # Permet un calcul fiable des joueurs uniques (7j)
-        session_history = data.get('session_history', [])[:30]
-        
-        # Calculer last_played à partir de session_history
-        # C'est la date de fin de la dernière session
-        last_played = None
-        if session_history and len(session_history) > 0:
-            last_session = session_history[0]
-            if last_session.get('end'):
-                last_played = last_session['end']
-        
         # Préserver certains champs du cache existant si présents
         # (au cas où le frontend les a modifiés pendant ce run)
         existing = existing_cache.get(doc_id, {})
@@ -972,23 +1353,93 @@ def write_players_cache(db):
             'roles': final_roles,
             'avatar_url': data.get('avatar_url', '') or existing.get('avatar_url', ''),
             'ingame_names': final_ingame_names,
-            'total_time_seconds': data.get('total_time_seconds', 0),
-            'session_count': data.get('session_count', 0),
-            'is_auto_detected': data.get('is_auto_detected', False),
-            'session_history': session_history,
-            'last_played': last_played,  # Date ISO de la dernière session
+            **backend_cache_fields(data),
         }
     
     try:
-        db.collection('cache').document('players').set({
+        _refs['players_cache'].set({
             'players': players_cache,
             'count': len(players_cache),
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
+        cache['players_cache_ids'] = set(players_cache)
+        cache['dirty_players'].clear()
         print(f"    📦 Cache: {len(players_cache)} joueurs")
     except Exception as e:
         print(f"    ⚠️ Cache: {e}")
 
+def write_players_cache_delta(db):
+    """Écrit uniquement les joueurs modifiés depuis la dernière écriture du cache
+    
+    set(merge=True) ne remplace que les champs envoyés: pas besoin de relire le
+    document, les champs gérés par le frontend (roles, ingame_names, steam_id)
+    et les joueurs créés par le frontend restent intacts.
+    """
+    if not cache['dirty_players']:
+        return
+    if not cache['players_cache_ids']:
+        # Contenu du document inconnu (aucune écriture complète réussie): tout réécrire
+        write_players_cache(db)
+        return
+    
+    changed = {}
+    for doc_id in cache['dirty_players']:
+        data = cache['players'].get(doc_id)
+        if not data:
+            continue
+        entry = backend_cache_fields(data)
+        if data.get('name'):
+            entry['name'] = data['name']
+        if data.get('avatar_url'):
+            entry['avatar_url'] = data['avatar_url']
+        if doc_id not in cache['players_cache_ids']:
+            # Nouveau joueur: initialiser aussi les champs du frontend
+            entry['name'] = data.get('name') or ''
+            entry['steam_id'] = data.get('steam_id') or ''
+            entry['roles'] = data.get('roles') or ['Joueur']
+            entry['ingame_names'] = data.get('ingame_names') or []
+            entry['avatar_url'] = data.get('avatar_url') or ''
+        changed[doc_id] = entry
+    
+    if not changed:
+        cache['dirty_players'].clear()
+        return
+    
+    known_ids = cache['players_cache_ids'] | set(changed)
+    try:
+        _refs['players_cache'].set({
+            'players': changed,
+            'count': len(known_ids),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+        cache['players_cache_ids'] = known_ids
+        cache['dirty_players'].clear()
+        print(f"    📦 Cache: {len(changed)} joueur(s) mis à jour")
+    except Exception as e:
+        print(f"    ⚠️ Cache: {e}")
+
+def backend_cache_fields(data):
+    """Champs du cache frontend calculés par le backend pour un joueur"""
+    # Garder 30 sessions dans le cache (couvre ~1 mois d'activité)
+    # Permet un calcul fiable des joueurs uniques (7j)
+    session_history = data.get('session_history', [])[:30]
+    
+    # Calculer last_played à partir de session_history
+    # C'est la date de fin de la dernière session
+    last_played = None
+    if session_history and len(session_history) > 0:
+        last_session = session_history[0]
+        if last_session.get('end'):
+            last_played = last_session['end']
+    
+    return {
+        'total_time_seconds': data.get('total_time_seconds', 0),
+        'session_count': data.get('session_count', 0),
+        'is_auto_detected': data.get('is_auto_detected', False),
+        'session_history': session_history,
+        'last_played': last_played,  # Date ISO de la dernière session
+    }
+
 # ============================================
 # Init Cache
 # ============================================
@@ -1004,20 +1455,36 @@ def init_cache(db, france_now):
     
     print("    📦 Chargement...")
     
+    # Les 3 documents isolés en un seul get_all (1 RPC), la collection joueurs en parallèle
+    init_refs_by_key = {
+        'daily': _refs['days'].document(today),
+        'records': _refs['records'],
+        'live': _refs['live'],
+    }
+    
+    def get_init_docs():
+        snapshots = {snap.reference.path: snap for snap in db.get_all(list(init_refs_by_key.values()))}
+        return {key: snapshots[ref.path] for key, ref in init_refs_by_key.items()}
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        docs_future = pool.submit(get_init_docs)
+        players_future = pool.submit(reload_players, db)
+    
     # Stats du jour
     try:
-        doc = db.collection('stats').document('daily').collection('days').document(today).get()
+        doc = docs_future.result()['daily']
         reads += 1
         if doc.exists:
             data = doc.to_dict()
             cache['hourly_stats'] = {int(k): v for k, v in data.get('hourly', {}).items()}
+            cache['hourly_persisted'] = dict(cache['hourly_stats'])
             cache['daily_peak'] = data.get('peak', 0)
     except Exception as e:
         print(f"    ⚠️ Stats: {e}")
     
     # Records
     try:
-        doc = db.collection('stats').document('records').get()
+        doc = docs_future.result()['records']
         reads += 1
         if doc.exists:
             record_data = doc.to_dict()
@@ -1037,7 +1504,7 @@ def init_cache(db, france_now):
     if not cache['record_valid']:
         try:
             print(f"    🔧 Reconstruction du record...")
-            days_ref = db.collection('stats').document('daily').collection('days')
+            days_ref = _refs['days']
             days_docs = days_ref.get()
             max_peak = 0
             max_date = None
@@ -1052,7 +1519,7 @@ def init_cache(db, france_now):
             if max_peak >= MIN_RECORD_THRESHOLD:
                 cache['record_peak'] = max_peak
                 cache['record_valid'] = True
-                db.collection('stats').document('records').set({
+                _refs['records'].set({
                     'peak_count': max_peak,
                     'peak_date': max_date
                 })
@@ -1065,16 +1532,7 @@ def init_cache(db, france_now):
     
     # Charger tous les joueurs
     try:
-        docs = db.collection('players').get()
-        for doc in docs:
-            reads += 1
-            data = doc.to_dict()
-            doc_id = doc.id
-            cache['players'][doc_id] = data
-            name = data.get('name', '')
-            if name:
-                cache['players_by_name'][name.lower().strip()] = doc_id
-                cache['players_by_name'][normalize_name(name)] = doc_id
+        reads += players_future.result()
         print(f"    👥 {len(cache['players'])} joueurs")
     except Exception as e:
         print(f"    ⚠️ Players: {e}")
@@ -1082,7 +1540,7 @@ def init_cache(db, france_now):
     # Charger live/status (état du run précédent)
     last_update_time = None
     try:
-        doc = db.collection('live').document('status').get()
+        doc = docs_future.result()['live']
         reads += 1
         if doc.exists:
             data = doc.to_dict()
@@ -1153,17 +1611,14 @@ def init_cache(db, france_now):
     
     return reads, writes
 
-def detect_missed_departures(db, current_players, france_now):
+def detect_missed_departures(db, current_players, france_now, batch):
     """
     Détecte les joueurs qui étaient là au run précédent mais ne sont plus là.
     Ce sont des départs manqués qu'il faut comptabiliser.
     """
     writes = 0
     
-    prev_names = set(cache['prev_players'].keys())
-    current_names = set(current_players.keys())
-    
-    missed_departures = prev_names - current_names
+    missed_departures = cache['prev_players'].keys() - current_players.keys()
     
     if missed_departures:
         print(f"    🔍 {len(missed_departures)} départ(s) manqué(s) détecté(s)")
@@ -1184,25 +1639,52 @@ def detect_missed_departures(db, current_players, france_now):
             started_at = prev_data.get('session_started_at')
             
             if doc_id and started_at:
-                writes = finalize_session(db, name, doc_id, started_at, estimated_departure, writes)
+                writes = finalize_session(db, name, doc_id, started_at, estimated_departure, writes, batch)
             else:
                 print(f"          ⚠️ {name}: données manquantes, ignoré")
             
             # Nettoyer
             cache['sessions'].pop(name, None)
             cache['prev_times'].pop(name, None)
+        
+        writes += batch.commit()
     
     return writes
 
 # ============================================
 # Query Server
 # ============================================
+# info et players sont indépendants: envoyés en parallèle (1 RTT au lieu de 2)
+_a2s_pool = ThreadPoolExecutor(max_workers=2)
+
+def resolve_server_address():
+    """Résout GMOD_HOST une seule fois par run (pas de getaddrinfo à chaque query)"""
+    global _server_address
+    try:
+        _server_address = (socket.gethostbyname(SERVER_IP), SERVER_PORT)
+    except OSError as e:
+        print(f"    ⚠️ DNS {SERVER_IP}: {e}")
+        _server_address = None
+    return _server_address
+
+def a2s_query(fn, address):
+    """Appelle a2s.info / a2s.players avec un timeout court, retenté sur perte de paquet"""
+    for attempt in range(A2S_ATTEMPTS):
+        try:
+            return fn(address, timeout=A2S_TIMEOUT)
+        except socket.timeout:
+            if attempt == A2S_ATTEMPTS - 1:
+                raise
+            time.sleep(0.25 * 2 ** attempt)
+
 def query_server():
     """Query le serveur GMod et retourne les données"""
     try:
-        address = (SERVER_IP, SERVER_PORT)
-        info = a2s.info(address, timeout=5)
-        players = a2s.players(address, timeout=5)
+        address = _server_address or (SERVER_IP, SERVER_PORT)
+        info_future = _a2s_pool.submit(a2s_query, a2s.info, address)
+        players_future = _a2s_pool.submit(a2s_query, a2s.players, address)
+        info = info_future.result()
+        players = players_future.result()
         
         player_data = {}
         for p in players:
@@ -1215,7 +1697,9 @@ def query_server():
             if not validate_player_time(time_val):
                 time_val = 0
             
-            player_data[name] = max(0, time_val)
+            # Nom internalisé: le même objet str d'un tick à l'autre (hash et comparaisons des
+            # dicts sessions/prev_times sans recomparer les caractères)
+            player_data[sys.intern(name)] = max(0, time_val)
         
         return {
             'ok': True,
@@ -1237,24 +1721,29 @@ def run_sync(db):
     
     france_now = get_france_time()
     cache['run_started_at'] = france_now  # Pour détecter les resets
+    run_start = time.monotonic()          # Horloge monotone pour le deadline du run
     
     print(f"\n🚀 GMod Monitor v21 - {france_now.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"    Serveur: {SERVER_IP}:{SERVER_PORT}")
+    resolve_server_address()
     print(f"    Intervalle: {QUERY_INTERVAL}s, Max queries: {MAX_QUERIES}")
     
     # Initialisation
     print("\n📦 INIT")
     reads, writes = init_cache(db, france_now)
     
+    # Un seul batch pour tout le run: une écriture à l'issue inconnue repart au commit suivant
+    batch = FirestoreBatch(db)
+    
     # Supprimer tout document reset résiduel
     just_reset = False
     just_reload = False
     try:
-        reset_doc = db.collection('system').document('reset').get()
+        reset_doc = _refs['reset'].get()
         if reset_doc.exists:
             reset_data = reset_doc.to_dict()
             reset_type = reset_data.get('type', 'reset')  # Par défaut = reset complet
-            db.collection('system').document('reset').delete()
+            _refs['reset'].delete()
             
             if reset_type == 'reload':
                 just_reload = True
@@ -1268,17 +1757,7 @@ def run_sync(db):
     # Si reload (mise à jour SteamID depuis script externe), juste recharger les données
     if just_reload:
         print("\n🔄 RECHARGEMENT DONNÉES")
-        cache['players'].clear()
-        cache['players_by_name'].clear()
-        docs = db.collection('players').get()
-        for doc in docs:
-            data = doc.to_dict()
-            doc_id = doc.id
-            cache['players'][doc_id] = data
-            name = data.get('name', '')
-            if name:
-                cache['players_by_name'][name.lower().strip()] = doc_id
-                cache['players_by_name'][normalize_name(name)] = doc_id
+        reload_players(db)
         print(f"    ✅ {len(cache['players'])} joueurs rechargés depuis Firestore")
         write_players_cache(db)
         print(f"    📦 Cache mis à jour")
@@ -1297,17 +1776,7 @@ def run_sync(db):
             # IMPORTANT: Recharger les données des joueurs depuis Firestore
             # car init_cache() a pu charger des données avant que le reset soit complet
             print(f"    🔄 Rechargement des données post-reset...")
-            cache['players'].clear()
-            cache['players_by_name'].clear()
-            docs = db.collection('players').get()
-            for doc in docs:
-                data = doc.to_dict()
-                doc_id = doc.id
-                cache['players'][doc_id] = data
-                name = data.get('name', '')
-                if name:
-                    cache['players_by_name'][name.lower().strip()] = doc_id
-                    cache['players_by_name'][normalize_name(name)] = doc_id
+            reload_players(db)
             print(f"    ✅ {len(cache['players'])} joueurs rechargés depuis Firestore")
             
             # Vider les sessions du cache (elles sont invalides)
@@ -1324,35 +1793,29 @@ def run_sync(db):
                     if found:
                         doc_id = found[0]
                         started_at = now - timedelta(seconds=time_val)
-                        try:
-                            data = cache['players'].get(doc_id, {})
-                            new_count = data.get('session_count', 0) + 1
-                            db.collection('players').document(doc_id).update({
-                                'session_count': new_count,
-                                'current_session_start': started_at.isoformat(),
-                                'last_seen': firestore.SERVER_TIMESTAMP
-                            })
-                            writes += 1
-                            if doc_id in cache['players']:
-                                cache['players'][doc_id]['session_count'] = new_count
-                            
-                            # Créer la session
-                            cache['sessions'][name] = {'started_at': started_at, 'doc_id': doc_id}
-                            cache['prev_times'][name] = time_val
-                            
-                            # Ajouter au feed
-                            add_activity_event('join', name, time_val, doc_id, timestamp=started_at)
-                            
-                            print(f"        ✅ {name}: session #{new_count}")
-                        except Exception as e:
-                            print(f"        ⚠️ {name}: {e}")
+                        data = cache['players'].get(doc_id, {})
+                        new_count = data.get('session_count', 0) + 1
+                        # Session et feed créés une fois l'écriture confirmée
+                        batch.update(_refs['players'].document(doc_id), {
+                            'session_count': new_count,
+                            'current_session_start': started_at.isoformat(),
+                            'last_seen': firestore.SERVER_TIMESTAMP
+                        }, on_commit=partial(
+                            player_written, doc_id, {'session_count': new_count},
+                            name=name,
+                            session={'started_at': started_at, 'doc_id': doc_id},
+                            event=('join', time_val, started_at),
+                            message=f"        ✅ {name}: session #{new_count}"
+                        ))
+                        cache['prev_times'][name] = time_val
+                writes += batch.commit()
             
             # Mettre à jour live/status IMMÉDIATEMENT avec les vrais joueurs en ligne
             online_players = []
             for name, time_val in current_players.items():
-                found = find_player(name)
-                doc_id = found[0] if found else None
+                # Session créée ci-dessus pour chaque joueur trouvé: pas de nouvelle recherche
                 session = cache['sessions'].get(name)
+                doc_id = session['doc_id'] if session else None
                 started_at = session['started_at'] if session else now - timedelta(seconds=time_val)
                 
                 online_players.append({
@@ -1362,13 +1825,15 @@ def run_sync(db):
                     'session_started_at': started_at.isoformat()
                 })
             
-            db.collection('live').document('status').set({
+            now_iso = now.isoformat()
+            cache['live_fingerprint'] = None
+            _refs['live'].set({
                 'ok': True,
                 'count': len(current_players),
                 'players': online_players,
                 'activity_feed': cache['activity_feed'],
-                'timestamp': now.isoformat(),
-                'updatedAt': now.isoformat()
+                'timestamp': now_iso,
+                'updatedAt': now_iso
             })
             writes += 1
             print(f"    📡 live/status mis à jour: {len(online_players)} joueurs en ligne")
@@ -1377,7 +1842,7 @@ def run_sync(db):
             write_players_cache(db)
         else:
             # Mode normal: détecter les départs manqués
-            writes += detect_missed_departures(db, current_players, now)
+            writes += detect_missed_departures(db, current_players, now, batch)
         
         # Générer le feed initial si vide ET créer les sessions
         if len(cache['activity_feed']) == 0 and len(current_players) > 0:
@@ -1400,7 +1865,7 @@ def run_sync(db):
             
             # Sauvegarder immédiatement
             try:
-                db.collection('live').document('status').update({
+                _refs['live'].update({
                     'activity_feed': cache['activity_feed']
                 })
             except:
@@ -1413,10 +1878,19 @@ def run_sync(db):
     query_count = 0
     total_writes = writes
     steam_cache = {}  # Cache des lookups Steam (par run)
+    ambiguous_warned = set()  # Noms ambigus sans SteamID déjà signalés (un log par run)
     
     while running and query_count < MAX_QUERIES:
+        # Des itérations lentes (Steam, Firestore) ne doivent pas dépasser le timeout du workflow
+        if time.monotonic() - run_start > RUN_DEADLINE:
+            print(f"\n    ⏰ Deadline du run atteint ({RUN_DEADLINE // 60} min), arrêt propre")
+            break
+        
         query_count += 1
+        tick_start = time.monotonic()
+        # Un seul échantillon de l'heure par itération: tous les timestamps écrits sont cohérents
         now = get_france_time()
+        now_iso = now.isoformat()
         today = now.strftime('%Y-%m-%d')
         hour = now.hour
         
@@ -1428,6 +1902,7 @@ def run_sync(db):
             print(f"\n    🌅 Nouveau jour: {today}")
             cache['today_date'] = today
             cache['hourly_stats'] = {}
+            cache['hourly_persisted'] = {}
             cache['daily_peak'] = 0
         
         print(f"\n    [{query_count}/{MAX_QUERIES}] {now.strftime('%H:%M:%S')}")
@@ -1448,49 +1923,51 @@ def run_sync(db):
                     cache['is_offline'] = True
                     print(f"       🔴 Serveur hors ligne")
                     
-                    # Finaliser toutes les sessions
+                    # Finaliser toutes les sessions en un commit (le feed suit les écritures confirmées)
                     for name, session in list(cache['sessions'].items()):
                         doc_id = session.get('doc_id')
                         started_at = session.get('started_at')
                         if doc_id and started_at:
-                            total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes)
+                            total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes, batch)
+                    total_writes += batch.commit()
                     
                     cache['sessions'].clear()
                     cache['prev_times'].clear()
                     
                     # Écrire statut offline
-                    db.collection('live').document('status').set({
+                    cache['live_fingerprint'] = None
+                    batch.set(_refs['live'], {
                         'ok': False,
                         'count': 0,
                         'players': [],
                         'activity_feed': cache['activity_feed'],
-                        'timestamp': now.isoformat(),
-                        'updatedAt': now.isoformat()
+                        'timestamp': now_iso,
+                        'updatedAt': now_iso
                     })
-                    total_writes += 1
+                    total_writes += batch.commit()
             
             wait_for_next_interval()
             continue
         
         # Serveur OK
         cache['consecutive_timeouts'] = 0
-        was_offline = cache['is_offline']
         cache['is_offline'] = False
         
         current_players = server_data.get('players', {})
-        current_names = set(current_players.keys())
         current_count = len(current_players)
         
-        previous_names = set(cache['sessions'].keys())
+        # Opérations directement sur les vues de clés: pas de copie intermédiaire des noms
+        current_names = current_players.keys()
+        previous_names = cache['sessions'].keys()
         
         joined = current_names - previous_names
         left = previous_names - current_names
         stayed = current_names & previous_names
         
-        players_changed = (joined or left or was_offline)
-        
         print(f"       👥 {current_count} joueurs | +{len(joined)} -{len(left)} ={len(stayed)}")
         
+        # Écritures du tick regroupées: joueurs envoyés après PHASE 4, live/status + stats après PHASE 7
+        
         # ============================================
         # PHASE 1: Détection reset serveur GMod
         # ============================================
@@ -1507,7 +1984,7 @@ def run_sync(db):
                     doc_id = session.get('doc_id')
                     started_at = session.get('started_at')
                     if doc_id and started_at:
-                        total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes)
+                        total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes, batch)
                 
                 # Créer une nouvelle session
                 new_started_at = now - timedelta(seconds=current_time)
@@ -1517,15 +1994,19 @@ def run_sync(db):
                     cache['sessions'][name] = {'started_at': new_started_at, 'doc_id': doc_id}
                     add_activity_event('join', name, current_time, doc_id, timestamp=new_started_at)
         
+        # Arrivées résolues une seule fois dans le cache (réutilisé par les PHASES 2 et 4)
+        joined_found = {name: find_player(name) for name in joined}
+        
         # ============================================
         # PHASE 2: Recherche Steam (pour les nouveaux)
         # ============================================
-        for name in joined:
-            if name not in steam_cache:
-                steam_id, avatar = fetch_steam_info(name)
-                steam_cache[name] = (steam_id, avatar)
-                if steam_id:
-                    print(f"       🔍 Steam: {name} → {steam_id}")
+        # Joueur déjà connu: résolu par le cache, la recherche Steam ne servirait pas
+        to_search = [name for name in joined if name not in steam_cache and not joined_found[name]]
+        # Recherches indépendantes: lancées en parallèle sur le pool Steam
+        for name, (steam_id, avatar) in zip(to_search, _steam_pool.map(fetch_steam_info, to_search)):
+            steam_cache[name] = (steam_id, avatar)
+            if steam_id:
+                print(f"       🔍 Steam: {name} → {steam_id}")
         
         # ============================================
         # PHASE 3: Départs
@@ -1538,21 +2019,16 @@ def run_sync(db):
                 started_at = session.get('started_at')
                 
                 if doc_id and started_at:
-                    total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes)
+                    total_writes = finalize_session(db, name, doc_id, started_at, now, total_writes, batch)
                 else:
                     # Session sans données complètes
                     found = find_player(name)
                     if found:
                         doc_id = found[0]
-                        try:
-                            db.collection('players').document(doc_id).update({
-                                'last_seen': firestore.SERVER_TIMESTAMP,
-                                'current_session_start': None
-                            })
-                            total_writes += 1
-                            add_activity_event('leave', name, 0, doc_id)
-                        except:
-                            pass
+                        batch.update(_refs['players'].document(doc_id), {
+                            'last_seen': firestore.SERVER_TIMESTAMP,
+                            'current_session_start': None
+                        }, on_commit=partial(add_activity_event, 'leave', name, 0, doc_id))
                     print(f"          👋 {name} (session incomplète)")
             
             cache['sessions'].pop(name, None)
@@ -1561,42 +2037,73 @@ def run_sync(db):
         # ============================================
         # PHASE 4: Arrivées
         # ============================================
+        # Avatars des joueurs connus à revérifier: Web API en une requête, profils en parallèle
+        api_avatars = {}
+        profile_avatars = {}
+        if joined:
+            to_check = {}  # steam_id -> avatar actuel
+            for name in joined:
+                found = joined_found[name]
+                if found and not avatar_is_fresh(found[1], now):
+                    steam_id = found[1].get('steam_id') or ''
+                    if steam_id.startswith('STEAM_'):
+                        to_check[steam_id] = found[1].get('avatar_url') or ''
+            api_avatars = fetch_steam_avatars(to_check)
+            # L'API ne connaît pas les avatars animés: ceux-là restent vérifiés sur le profil
+            to_scrape = [
+                steam_id for steam_id, current_avatar in to_check.items()
+                if steam_id not in api_avatars or current_avatar.lower().endswith(ANIMATED_AVATAR_EXTS)
+            ]
+            if to_scrape:
+                profile_avatars = dict(zip(to_scrape, _steam_pool.map(fetch_steam_avatar, to_scrape)))
+        
+        server_ts = firestore.SERVER_TIMESTAMP
         for name in joined:
             session_time = current_players[name]
             started_at = now - timedelta(seconds=session_time)
+            started_iso = started_at.isoformat()  # Partagé par toutes les branches ci-dessous
             
-            existing = find_player(name)
+            existing = joined_found[name]
             
             if existing:
                 doc_id, data = existing
                 doc_id = sanitize_doc_id(doc_id)
                 if not doc_id:
                     continue
+                ref = _refs['players'].document(doc_id)
+                # Écriture déjà en attente sur ce document (ex: départ sous l'ancien nom): l'envoyer d'abord
+                batch.wait_for(ref)
                 
-                steam_id = data.get('steam_id', '')
+                # steam_id peut valoir None (champ vidé côté frontend)
+                steam_id = data.get('steam_id') or ''
                 
                 update = {
-                    'last_seen': firestore.SERVER_TIMESTAMP,
-                    'current_session_start': started_at.isoformat(),
+                    'last_seen': server_ts,
+                    'current_session_start': started_iso,
                     'session_count': data.get('session_count', 0) + 1
                 }
                 
-                # Refresh avatar
-                if steam_id.startswith('STEAM_'):
-                    avatar = fetch_steam_avatar(steam_id)
-                    if avatar and avatar != data.get('avatar_url'):
-                        update['avatar_url'] = avatar
+                # Refresh avatar (pas de requête Steam si vérifié récemment)
+                if steam_id.startswith('STEAM_') and not avatar_is_fresh(data, now):
+                    current_avatar = data.get('avatar_url') or ''
+                    # Résultat du profil prioritaire (même vide): un échec ne remplace pas un avatar animé
+                    if steam_id in profile_avatars:
+                        avatar = profile_avatars[steam_id]
+                    else:
+                        avatar = api_avatars.get(steam_id)
+                    if avatar:
+                        update['avatar_checked_at'] = now_iso
+                        if avatar != current_avatar:
+                            update['avatar_url'] = avatar
                 
-                try:
-                    db.collection('players').document(doc_id).update(update)
-                    total_writes += 1
-                    update_player_cache(doc_id, {**data, **update})
-                    
-                    cache['sessions'][name] = {'started_at': started_at, 'doc_id': doc_id}
-                    add_activity_event('join', name, session_time, doc_id, timestamp=started_at)
-                    print(f"          ⬆️ {name} ({format_duration(session_time)})")
-                except Exception as e:
-                    print(f"          ❌ Arrivée {name}: {e}")
+                # Session créée une fois l'écriture confirmée: sinon l'arrivée est retentée au tick suivant
+                batch.update(ref, update, on_commit=partial(
+                    player_written, doc_id, update,
+                    name=name,
+                    session={'started_at': started_at, 'doc_id': doc_id},
+                    event=('join', session_time, started_at),
+                    message=f"          ⬆️ {name} ({format_duration(session_time)})"
+                ))
             else:
                 # Nouveau joueur
                 steam2, avatar_url = steam_cache.get(name, (None, None))
@@ -1605,6 +2112,8 @@ def run_sync(db):
                     doc_id = sanitize_doc_id(steam2)
                     if not doc_id:
                         continue
+                    ref = _refs['players'].document(doc_id)
+                    batch.wait_for(ref)
                     
                     existing_data = cache['players'].get(doc_id)
                     
@@ -1612,21 +2121,21 @@ def run_sync(db):
                         # SteamID existe déjà
                         update = {
                             'name': name,
-                            'last_seen': firestore.SERVER_TIMESTAMP,
-                            'current_session_start': started_at.isoformat(),
+                            'last_seen': server_ts,
+                            'current_session_start': started_iso,
                             'session_count': existing_data.get('session_count', 0) + 1
                         }
                         if avatar_url:
                             update['avatar_url'] = avatar_url
+                            update['avatar_checked_at'] = now_iso
                         
-                        try:
-                            db.collection('players').document(doc_id).update(update)
-                            total_writes += 1
-                            update_player_cache(doc_id, {**existing_data, **update})
-                            add_activity_event('join', name, session_time, doc_id, timestamp=started_at)
-                            print(f"          🔄 {name} (steam existant)")
-                        except Exception as e:
-                            print(f"          ❌ {name}: {e}")
+                        batch.update(ref, update, on_commit=partial(
+                            player_written, doc_id, update,
+                            name=name,
+                            session={'started_at': started_at, 'doc_id': doc_id},
+                            event=('join', session_time, started_at),
+                            message=f"          🔄 {name} (steam existant)"
+                        ))
                     else:
                         # Vraiment nouveau
                         new_player = {
@@ -1634,69 +2143,72 @@ def run_sync(db):
                             'steam_id': doc_id,
                             'roles': ['Joueur'],
                             'ingame_names': [],
-                            'created_at': firestore.SERVER_TIMESTAMP,
-                            'last_seen': firestore.SERVER_TIMESTAMP,
-                            'current_session_start': started_at.isoformat(),
+                            'created_at': server_ts,
+                            'last_seen': server_ts,
+                            'current_session_start': started_iso,
                             'total_time_seconds': 0,
                             'session_count': 1,
                             'session_history': [],
                             'is_auto_detected': False,
                             'avatar_url': avatar_url
                         }
-                        try:
-                            db.collection('players').document(doc_id).set(new_player)
-                            total_writes += 1
-                            update_player_cache(doc_id, new_player)
-                            add_activity_event('join', name, session_time, doc_id, timestamp=started_at)
-                            print(f"          🆕✅ {name}")
-                        except Exception as e:
-                            print(f"          ❌ {name}: {e}")
-                    
-                    cache['sessions'][name] = {'started_at': started_at, 'doc_id': doc_id}
+                        if avatar_url:
+                            new_player['avatar_checked_at'] = now_iso
+                        batch.set(ref, new_player, on_commit=partial(
+                            player_written, doc_id, new_player,
+                            name=name,
+                            session={'started_at': started_at, 'doc_id': doc_id},
+                            event=('join', session_time, started_at),
+                            message=f"          🆕✅ {name}"
+                        ))
+                elif name_is_ambiguous(name):
+                    # auto_<clé> serait le document d'un autre joueur de même clé: rien n'est attribué
+                    if name not in ambiguous_warned:
+                        ambiguous_warned.add(name)
+                        print(f"          ⚠️ {name}: nom ambigu sans SteamID, session non attribuée")
                 else:
                     # Pas de Steam → auto_xxx
-                    key = normalize_name(name) or 'unknown'
-                    doc_id = sanitize_doc_id(f"auto_{key}") or f"auto_{hash(name) & 0xFFFFFFFF}"
+                    doc_id = auto_doc_id(name)
+                    ref = _refs['players'].document(doc_id)
+                    batch.wait_for(ref)
                     
                     existing_auto = cache['players'].get(doc_id)
+                    # Session, feed et log une fois l'écriture confirmée (sinon arrivée retentée au tick suivant)
+                    on_written = partial(
+                        player_written,
+                        name=name,
+                        session={'started_at': started_at, 'doc_id': doc_id},
+                        event=('join', session_time, started_at),
+                        message=f"          🆕 {name} (auto)"
+                    )
                     
                     if existing_auto:
                         update = {
                             'name': name,
-                            'last_seen': firestore.SERVER_TIMESTAMP,
-                            'current_session_start': started_at.isoformat(),
+                            'last_seen': server_ts,
+                            'current_session_start': started_iso,
                             'session_count': existing_auto.get('session_count', 0) + 1
                         }
-                        try:
-                            db.collection('players').document(doc_id).update(update)
-                            total_writes += 1
-                            update_player_cache(doc_id, {**existing_auto, **update})
-                        except:
-                            pass
+                        batch.update(ref, update, on_commit=partial(on_written, doc_id, update))
                     else:
                         new_player = {
                             'name': name,
                             'steam_id': doc_id,
                             'roles': ['Joueur'],
                             'ingame_names': [],
-                            'created_at': firestore.SERVER_TIMESTAMP,
-                            'last_seen': firestore.SERVER_TIMESTAMP,
-                            'current_session_start': started_at.isoformat(),
+                            'created_at': server_ts,
+                            'last_seen': server_ts,
+                            'current_session_start': started_iso,
                             'total_time_seconds': 0,
                             'session_count': 1,
                             'session_history': [],
                             'is_auto_detected': True
                         }
-                        try:
-                            db.collection('players').document(doc_id).set(new_player)
-                            total_writes += 1
-                            update_player_cache(doc_id, new_player)
-                        except:
-                            pass
-                    
-                    cache['sessions'][name] = {'started_at': started_at, 'doc_id': doc_id}
-                    add_activity_event('join', name, session_time, doc_id, timestamp=started_at)
-                    print(f"          🆕 {name} (auto)")
+                        batch.set(ref, new_player, on_commit=partial(on_written, doc_id, new_player))
+        
+        # Écritures joueurs envoyées avant live/status: sessions et feed n'y reflètent que
+        # les écritures confirmées (aucun RPC si personne n'est arrivé ni parti)
+        total_writes += batch.commit()
         
         # ============================================
         # PHASE 5: Stayed - vérifier cohérence
@@ -1714,93 +2226,115 @@ def run_sync(db):
         # ============================================
         # PHASE 6: Écrire live/status
         # ============================================
-        players_for_firebase = []
-        for name, time_val in current_players.items():
-            session = cache['sessions'].get(name)
+        # Empreinte du contenu utile, prise directement sur les sessions: un tick sans
+        # changement ne formate aucune entrée et n'écrit rien
+        sessions = cache['sessions']
+        player_keys = []
+        for name in current_players:
+            session = sessions.get(name)
             doc_id = session.get('doc_id') if session else None
-            
-            entry = {
-                'name': name, 
-                'time': time_val,
-                'doc_id': doc_id
-            }
-            
-            if session and session.get('started_at'):
-                entry['session_started_at'] = session['started_at'].isoformat()
-            else:
-                entry['session_started_at'] = (now - timedelta(seconds=time_val)).isoformat()
-            
-            players_for_firebase.append(entry)
+            player_keys.append((name, doc_id, session.get('started_at') if doc_id else None))
+        feed_head = cache['activity_feed'][0] if cache['activity_feed'] else {}
+        live_fingerprint = (
+            server_data['map'], server_data['max_players'], server_data['server_name'],
+            frozenset(player_keys),
+            (feed_head.get('type'), feed_head.get('name'), feed_head.get('timestamp')),
+        )
         
-        if players_changed:
-            try:
-                db.collection('live').document('status').set({
-                    'ok': True,
-                    'count': current_count,
-                    'max': server_data['max_players'],
-                    'map': server_data['map'],
-                    'server': server_data['server_name'],
-                    'players': players_for_firebase,
-                    'activity_feed': cache['activity_feed'],
-                    'timestamp': now.isoformat(),
-                    'updatedAt': now.isoformat()
-                })
-                total_writes += 1
-            except Exception as e:
-                print(f"       ⚠️ Live: {e}")
+        live_changed = live_fingerprint != cache['live_fingerprint']
+        if live_changed:
+            players_for_firebase = []
+            for name, time_val in current_players.items():
+                session = sessions.get(name)
+                doc_id = session.get('doc_id') if session else None
+                
+                entry = {
+                    'name': name, 
+                    'time': time_val,
+                    'doc_id': doc_id
+                }
+                
+                if session and session.get('started_at'):
+                    entry['session_started_at'] = session['started_at'].isoformat()
+                else:
+                    entry['session_started_at'] = (now - timedelta(seconds=time_val)).isoformat()
+                
+                players_for_firebase.append(entry)
+            
+            # Empreinte retenue une fois l'écriture confirmée: un échec est retenté au tick suivant
+            batch.set(_refs['live'], {
+                'ok': True,
+                'count': current_count,
+                'max': server_data['max_players'],
+                'map': server_data['map'],
+                'server': server_data['server_name'],
+                'players': players_for_firebase,
+                'activity_feed': cache['activity_feed'],
+                'timestamp': now_iso,
+                'updatedAt': now_iso
+            }, on_commit=lambda: cache.update(live_fingerprint=live_fingerprint))
         
-        # Mettre à jour prev_times
-        cache['prev_times'] = current_players.copy()
+        # Mettre à jour prev_times: dict neuf à chaque query, jamais modifié ensuite, pas besoin de copie
+        cache['prev_times'] = current_players
         
         # ============================================
-        # PHASE 7: Stats
+        # PHASE 7: Stats (dans le batch du tick, puis commit)
         # ============================================
-        cached_hour = cache['hourly_stats'].get(hour, -1)
-        if cached_hour == -1 or current_count > cached_hour:
-            cache['hourly_stats'][hour] = max(cached_hour if cached_hour >= 0 else 0, current_count)
-            cache['daily_peak'] = max(cache['daily_peak'], current_count)
-            
-            try:
-                db.collection('stats').document('daily').collection('days').document(today).set({
-                    'date': today,
-                    'peak': cache['daily_peak'],
-                    'hourly': {str(k): v for k, v in cache['hourly_stats'].items()},
-                    'last_update': firestore.SERVER_TIMESTAMP
-                }, merge=True)
-                total_writes += 1
-                print(f"       📈 H{hour}: {current_count}")
-            except:
-                pass
+        # Cas courant: pic de l'heure déjà enregistré, une seule comparaison et aucune écriture
+        cached_hour = cache['hourly_stats'].get(hour)
+        if cached_hour is None or current_count > cached_hour:
+            cache['hourly_stats'][hour] = current_count
+            if current_count > cache['daily_peak']:
+                cache['daily_peak'] = current_count
+        
+        # Toute heure non confirmée est écrite, pas seulement l'heure courante: un commit
+        # raté en fin d'heure est retenté au tick suivant, même après le changement d'heure
+        persisted = cache['hourly_persisted']
+        pending_hours = {h: v for h, v in cache['hourly_stats'].items() if persisted.get(h) != v}
+        if pending_hours:
+            # merge=True fusionne la map 'hourly': seules les heures modifiées sont envoyées
+            batch.set(_refs['days'].document(today), {
+                'date': today,
+                'peak': cache['daily_peak'],
+                'hourly': {str(h): v for h, v in pending_hours.items()},
+                'last_update': firestore.SERVER_TIMESTAMP
+            }, merge=True, on_commit=lambda: persisted.update(pending_hours))
+            for h, v in pending_hours.items():
+                print(f"       📈 H{h}: {v}")
+        
+        # Un seul commit pour live/status + stats
+        total_writes += batch.commit()
         
         # Record
         if cache['record_valid'] and current_count > cache['record_peak'] and current_count >= MIN_RECORD_THRESHOLD:
             try:
-                current_record_doc = db.collection('stats').document('records').get()
-                if current_record_doc.exists:
-                    current_record = current_record_doc.to_dict().get('peak_count', 0)
-                    if current_count > current_record:
-                        cache['record_peak'] = current_count
-                        db.collection('stats').document('records').set({
-                            'peak_count': current_count,
-                            'peak_date': now.isoformat()
-                        })
-                        total_writes += 1
-                        print(f"       🏆 NOUVEAU RECORD: {current_count}!")
-                    else:
-                        cache['record_peak'] = current_record
+                current_record, is_new = bump_record(db.transaction(), current_count, now_iso)
+                if is_new:
+                    total_writes += 1
+                    print(f"       🏆 NOUVEAU RECORD: {current_count}!")
+                if current_record is not None:
+                    cache['record_peak'] = current_record
             except Exception as e:
                 print(f"       ⚠️ Record: {e}")
         
         # ============================================
-        # PHASE 8: Cache players (si changements)
+        # PHASE 8: Cache players (joueurs modifiés uniquement)
         # ============================================
-        if players_changed:
-            write_players_cache(db)
+        write_players_cache_delta(db)
+        
+        # Une itération plus longue que l'intervalle fait sauter un créneau :00/:30
+        tick_duration = time.monotonic() - tick_start
+        if tick_duration > QUERY_INTERVAL:
+            print(f"       ⚠️ Itération lente ({tick_duration:.0f}s), créneau sauté")
         
         # Attendre le prochain intervalle
         wait_for_next_interval()
     
-    # Fin du run
+    if _stop_signal is not None:
+        print(f"\n⚠️ Signal {_stop_signal} reçu, arrêt propre...")
+    
+    # Fin du run: dernier envoi des écritures restées en attente (issue inconnue au dernier tick)
+    total_writes += batch.commit()
     print(f"\n✅ Fin du monitoring: {query_count} queries, {total_writes} writes")
     return total_writes
 
@@ -1829,7 +2363,6 @@ def main():
         
     except Exception as e:
         print(f"\n❌ Erreur fatale: {e}")
-        import traceback
         traceback.print_exc()
         
         # Tenter de libérer le lock même en cas d'erreur